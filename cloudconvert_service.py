@@ -3,215 +3,235 @@ CloudConvert service for video format conversion
 """
 import logging
 import asyncio
+import json
+import tempfile
+from typing import IO, Union
+
 import aiohttp
+import orjson
 from config import CLOUDCONVERT_API_KEY
+from http_client import get_session
 
 logger = logging.getLogger(__name__)
 
+# The job definition never changes at runtime, so serialize it once
+_JOB_PAYLOAD_JSON = json.dumps({
+    "tasks": {
+        "import-video": {
+            "operation": "import/upload"
+        },
+        "convert-video": {
+            "operation": "convert",
+            "input": "import-video",
+            "output_format": "mp4",
+            "video_codec": "x264",
+            "audio_codec": "aac"
+        },
+        "export-video": {
+            "operation": "export/url",
+            "input": "convert-video"
+        }
+    }
+}).encode()
+
 
 class CloudConvertService:
     """Handles video format conversion using CloudConvert API directly"""
-    
+
     def __init__(self):
         self.api_key = CLOUDCONVERT_API_KEY
         self.base_url = "https://api.cloudconvert.com/v2"
-    
-    async def convert_video_to_mp4(self, video_data: bytes, filename: str = "video") -> bytes:
+        self.sync_base_url = "https://sync.api.cloudconvert.com/v2"
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def _create_job(self, session: aiohttp.ClientSession, headers: dict) -> dict:
+        """Create an upload->convert->export job and return its payload"""
+        async with session.post(f"{self.base_url}/jobs", data=_JOB_PAYLOAD_JSON, headers=headers) as response:
+            if response.status != 201:
+                error = await response.text()
+                raise Exception(f"Failed to create CloudConvert job: {error}")
+            return await response.json(loads=orjson.loads)
+
+    async def _upload(self, session: aiohttp.ClientSession, result: dict,
+                      video_data: Union[bytes, bytearray, memoryview, IO[bytes]], filename: str):
         """
-        Convert video to MP4 format with H.264 codec
-        
-        Args:
-            video_data: Video file as bytes
-            filename: Original filename (without extension)
-        
+        Upload the video to the job's import-upload form endpoint
+
+        Accepts either an in-memory buffer or an open binary file; file
+        objects are streamed chunk by chunk by aiohttp instead of being
+        materialized in memory.
+        """
+        tasks_by_name = {t['name']: t for t in result['data']['tasks']}
+        upload_task = tasks_by_name['import-video']
+        upload_url = upload_task['result']['form']['url']
+        upload_params = upload_task['result']['form']['parameters']
+
+        form = aiohttp.FormData()
+        for key, value in upload_params.items():
+            form.add_field(key, value)
+        form.add_field('file', video_data, filename=f"{filename}.mp4")
+
+        async with session.post(upload_url, data=form) as upload_response:
+            if upload_response.status not in [200, 201]:
+                error = await upload_response.text()
+                raise Exception(f"Failed to upload to CloudConvert: {error}")
+
+        logger.info("Video uploaded to CloudConvert")
+
+    async def _wait_for_job(self, session: aiohttp.ClientSession, job_id: str, headers: dict,
+                            max_wait_seconds: float = 600) -> dict:
+        """
+        Wait for a CloudConvert job to finish
+
+        Prefers the sync API endpoint, which long-polls server-side and
+        responds as soon as the job reaches a terminal state - one request
+        instead of a GET loop. Falls back to truncated exponential backoff
+        polling (1s growing 1.7x, capped at 15s) if the sync wait fails.
+
         Returns:
-            Converted video as bytes
+            Final job status payload
         """
         try:
-            logger.info(f"Starting CloudConvert video conversion: {len(video_data)} bytes")
-            
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                job_payload = {
-                    "tasks": {
-                        "import-video": {
-                            "operation": "import/upload"
-                        },
-                        "convert-video": {
-                            "operation": "convert",
-                            "input": "import-video",
-                            "output_format": "mp4",
-                            "video_codec": "x264",
-                            "audio_codec": "aac"
-                        },
-                        "export-video": {
-                            "operation": "export/url",
-                            "input": "convert-video"
-                        }
-                    }
-                }
-                
-                async with session.post(f"{self.base_url}/jobs", json=job_payload, headers=headers) as response:
-                    if response.status != 201:
-                        error = await response.text()
-                        raise Exception(f"Failed to create CloudConvert job: {error}")
-                    result = await response.json()
-                
-                job_id = result['data']['id']
-                logger.info(f"CloudConvert job created: {job_id}")
-                
-                upload_task = [t for t in result['data']['tasks'] if t['name'] == 'import-video'][0]
-                upload_url = upload_task['result']['form']['url']
-                upload_params = upload_task['result']['form']['parameters']
-                
-                form = aiohttp.FormData()
-                for key, value in upload_params.items():
-                    form.add_field(key, value)
-                form.add_field('file', video_data, filename=f"{filename}.mp4")
-                
-                async with session.post(upload_url, data=form) as upload_response:
-                    if upload_response.status not in [200, 201]:
-                        error = await upload_response.text()
-                        raise Exception(f"Failed to upload to CloudConvert: {error}")
-                
-                logger.info("Video uploaded to CloudConvert")
-                
-                while True:
-                    await asyncio.sleep(5)
-                    
-                    async with session.get(f"{self.base_url}/jobs/{job_id}", headers=headers) as status_response:
-                        if status_response.status != 200:
-                            error = await status_response.text()
-                            raise Exception(f"Failed to check job status: {error}")
-                        status_result = await status_response.json()
-                    
+            async with session.get(
+                f"{self.sync_base_url}/jobs/{job_id}", headers=headers,
+                timeout=aiohttp.ClientTimeout(total=max_wait_seconds)
+            ) as sync_response:
+                if sync_response.status == 200:
+                    status_result = await sync_response.json(loads=orjson.loads)
                     job_status = status_result['data']['status']
-                    logger.info(f"CloudConvert job status: {job_status}")
-                    
+                    logger.info(f"CloudConvert job status (sync wait): {job_status}")
+
                     if job_status == 'finished':
-                        break
-                    elif job_status in ['error', 'failed']:
+                        return status_result
+                    if job_status in ['error', 'failed']:
                         raise Exception(f"CloudConvert job failed: {status_result['data'].get('message', 'Unknown error')}")
-                
-                export_task = [t for t in status_result['data']['tasks'] if t['name'] == 'export-video'][0]
-                file_url = export_task['result']['files'][0]['url']
-                
-                logger.info(f"Downloading converted video from: {file_url}")
-                
-                async with session.get(file_url) as download_response:
-                    if download_response.status != 200:
-                        error = await download_response.text()
-                        raise Exception(f"Failed to download converted video: {error}")
-                    converted_data = await download_response.read()
-                
-                logger.info(f"Video converted successfully: {len(converted_data)} bytes")
-                return converted_data
-        
+                else:
+                    logger.warning(f"CloudConvert sync wait returned {sync_response.status}, falling back to polling")
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"CloudConvert job {job_id} did not finish within {max_wait_seconds} seconds")
+        except aiohttp.ClientError as e:
+            logger.warning(f"CloudConvert sync wait failed ({e}), falling back to polling")
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + max_wait_seconds
+        delay = 1.0
+
+        while True:
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.7, 15.0)
+
+            async with session.get(f"{self.base_url}/jobs/{job_id}", headers=headers) as status_response:
+                if status_response.status != 200:
+                    error = await status_response.text()
+                    raise Exception(f"Failed to check job status: {error}")
+                status_result = await status_response.json(loads=orjson.loads)
+
+            job_status = status_result['data']['status']
+            logger.info(f"CloudConvert job status: {job_status}")
+
+            if job_status == 'finished':
+                return status_result
+            elif job_status in ['error', 'failed']:
+                raise Exception(f"CloudConvert job failed: {status_result['data'].get('message', 'Unknown error')}")
+
+            if loop.time() >= deadline:
+                raise TimeoutError(f"CloudConvert job {job_id} did not finish within {max_wait_seconds} seconds")
+
+    def _get_export_url(self, status_result: dict) -> str:
+        """Extract the exported file URL from a finished job payload"""
+        tasks_by_name = {t['name']: t for t in status_result['data']['tasks']}
+        return tasks_by_name['export-video']['result']['files'][0]['url']
+
+    async def _run_conversion_job(self, video_data: Union[bytes, bytearray, memoryview, IO[bytes]],
+                                  filename: str) -> str:
+        """Run the full create->upload->wait cycle and return the exported file URL"""
+        session = await get_session()
+        headers = self._headers()
+
+        result = await self._create_job(session, headers)
+        job_id = result['data']['id']
+        logger.info(f"CloudConvert job created: {job_id}")
+
+        await self._upload(session, result, video_data, filename)
+
+        status_result = await self._wait_for_job(session, job_id, headers)
+
+        return self._get_export_url(status_result)
+
+    async def convert_video_to_mp4(self, video_data: Union[bytes, bytearray, memoryview, IO[bytes]],
+                                   filename: str = "video") -> IO[bytes]:
+        """
+        Convert video to MP4 format with H.264 codec
+
+        Args:
+            video_data: Video file as a buffer or open binary file
+            filename: Original filename (without extension)
+
+        Returns:
+            Converted video as a spooled temp file, positioned at the start
+        """
+        try:
+            logger.info("Starting CloudConvert video conversion")
+
+            file_url = await self._run_conversion_job(video_data, filename)
+
+            logger.info(f"Downloading converted video from: {file_url}")
+
+            converted = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+            session = await get_session()
+            async with session.get(file_url) as download_response:
+                if download_response.status != 200:
+                    error = await download_response.text()
+                    raise Exception(f"Failed to download converted video: {error}")
+                async for chunk in download_response.content.iter_chunked(1 << 16):
+                    converted.write(chunk)
+
+            size = converted.tell()
+            converted.seek(0)
+            logger.info(f"Video converted successfully: {size} bytes")
+            return converted
+
         except Exception as e:
             logger.error(f"CloudConvert conversion failed: {str(e)}")
             raise
-    
-    async def convert_video_to_mp4_url(self, video_data: bytes, filename: str = "video") -> str:
+
+    async def convert_video_to_mp4_url(self, video_data: Union[bytes, bytearray, memoryview, IO[bytes]],
+                                       filename: str = "video") -> str:
         """
         Convert video to MP4 and return CloudConvert URL (valid for 24h)
-        
+
         Args:
-            video_data: Video file as bytes
+            video_data: Video file as a buffer or open binary file
             filename: Original filename
-        
+
         Returns:
             Public URL of converted video
         """
         try:
-            logger.info(f"Converting video and getting URL: {len(video_data)} bytes")
-            
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                job_payload = {
-                    "tasks": {
-                        "import-video": {
-                            "operation": "import/upload"
-                        },
-                        "convert-video": {
-                            "operation": "convert",
-                            "input": "import-video",
-                            "output_format": "mp4",
-                            "video_codec": "x264",
-                            "audio_codec": "aac"
-                        },
-                        "export-video": {
-                            "operation": "export/url",
-                            "input": "convert-video"
-                        }
-                    }
-                }
-                
-                async with session.post(f"{self.base_url}/jobs", json=job_payload, headers=headers) as response:
-                    if response.status != 201:
-                        error = await response.text()
-                        raise Exception(f"Failed to create CloudConvert job: {error}")
-                    result = await response.json()
-                
-                job_id = result['data']['id']
-                
-                upload_task = [t for t in result['data']['tasks'] if t['name'] == 'import-video'][0]
-                upload_url = upload_task['result']['form']['url']
-                upload_params = upload_task['result']['form']['parameters']
-                
-                form = aiohttp.FormData()
-                for key, value in upload_params.items():
-                    form.add_field(key, value)
-                form.add_field('file', video_data, filename=f"{filename}.mp4")
-                
-                async with session.post(upload_url, data=form) as upload_response:
-                    if upload_response.status not in [200, 201]:
-                        error = await upload_response.text()
-                        raise Exception(f"Failed to upload: {error}")
-                
-                logger.info("Video uploaded to CloudConvert")
-                
-                while True:
-                    await asyncio.sleep(5)
-                    
-                    async with session.get(f"{self.base_url}/jobs/{job_id}", headers=headers) as status_response:
-                        if status_response.status != 200:
-                            raise Exception("Failed to check job status")
-                        status_result = await status_response.json()
-                    
-                    job_status = status_result['data']['status']
-                    logger.info(f"CloudConvert job status: {job_status}")
-                    
-                    if job_status == 'finished':
-                        break
-                    elif job_status in ['error', 'failed']:
-                        raise Exception(f"CloudConvert job failed")
-                
-                export_task = [t for t in status_result['data']['tasks'] if t['name'] == 'export-video'][0]
-                file_url = export_task['result']['files'][0]['url']
-                
-                logger.info(f"Video URL ready (valid 24h): {file_url}")
-                return file_url
-        
+            logger.info("Converting video and getting URL")
+
+            file_url = await self._run_conversion_job(video_data, filename)
+
+            logger.info(f"Video URL ready (valid 24h): {file_url}")
+            return file_url
+
         except Exception as e:
             logger.error(f"CloudConvert URL generation failed: {str(e)}")
             raise
-    
-    async def convert_and_get_url(self, video_data: bytes) -> str:
+
+    async def convert_and_get_url(self, video_data: Union[bytes, bytearray, memoryview, IO[bytes]]) -> str:
         """
         Alias for convert_video_to_mp4_url
         Upload video and get public URL (valid 24h)
-        
+
         Args:
-            video_data: Video file as bytes
-        
+            video_data: Video file as a buffer or open binary file
+
         Returns:
             Public URL of converted video
         """
@@ -1,10 +1,17 @@
 import logging
 import asyncio
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from typing import Dict, List, Tuple, Optional
+
 from telegram import Bot, Message
 from io import BytesIO
 
 from error_handler import ErrorHandler
+from http_client import get_session
 from translation_service import TranslationService
 from heygen_service import HeyGenService
 from cloudconvert_service import CloudConvertService
@@ -15,6 +22,28 @@ from config import CAROUSEL_WAIT_TIMEOUT, MAX_CAROUSEL_ITEMS, CAPTION_MAX_LENGTH
 logger = logging.getLogger(__name__)
 
 
+def _truncate_caption(text: str, limit: int = CAPTION_MAX_LENGTH) -> str:
+    """
+    Cap a caption at limit characters, appending an ellipsis when cut
+
+    Captions under the limit (the common case) are returned as-is with no
+    allocation. Slicing a str is code-point safe, so emoji-heavy captions
+    are never cut mid-character.
+    """
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1] + "…"
+
+
+@dataclass
+class CarouselState:
+    """Everything tracked for one in-flight media group"""
+    items: List[Tuple[str, str]] = field(default_factory=list)  # (file_id, media_type)
+    caption: str = ""
+    timer: Optional[asyncio.Task] = None
+    deadline: float = 0.0
+
+
 class ContentProcessor:
     
     def __init__(
@@ -35,9 +64,49 @@ class ContentProcessor:
         self.subtitle = subtitle_service
         self.uploadpost = uploadpost_service
         
-        self.carousel_groups: Dict[str, List[Tuple[bytes, str]]] = {}
-        self.carousel_captions: Dict[str, str] = {}
-        self.carousel_timers: Dict[str, asyncio.Task] = {}
+        self.carousels: Dict[str, CarouselState] = {}
+        self._download_semaphore = asyncio.Semaphore(4)
+        self._caption_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._caption_cache_size = 512
+        self._file_path_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._file_path_cache_size = 256
+
+        # Retry wrappers are built once here instead of per message; each
+        # with_retry call allocates a fresh closure, so rebuilding them on
+        # the hot path was pure churn
+        self._translate_caption = error_handler.with_retry(
+            module_name="CaptionTranslation",
+            scenario="Translating caption",
+            fallback_func=translation_service.translate_caption_openai_fallback
+        )(translation_service.translate_caption)
+        self._publish_photo = error_handler.with_retry(
+            module_name="InstagramPublish",
+            scenario="Publishing photo to Instagram"
+        )(uploadpost_service.publish_photo)
+        self._publish_photo_carousel = error_handler.with_retry(
+            module_name="InstagramPublish",
+            scenario="Publishing photo carousel to Instagram"
+        )(uploadpost_service.publish_carousel)
+        self._publish_mixed_carousel = error_handler.with_retry(
+            module_name="InstagramPublish",
+            scenario="Publishing mixed carousel to Instagram"
+        )(uploadpost_service.publish_mixed_carousel)
+        self._convert_video = error_handler.with_retry(
+            module_name="CloudConvert",
+            scenario="Converting video to MP4 and getting URL"
+        )(cloudconvert_service.convert_video_to_mp4_url)
+        self._translate_video = error_handler.with_retry(
+            module_name="HeyGenTranslation",
+            scenario="Translating video with HeyGen"
+        )(heygen_service.translate_video)
+        self._add_subtitles = error_handler.with_retry(
+            module_name="SubtitleGeneration",
+            scenario="Adding subtitles to translated video"
+        )(subtitle_service.add_subtitles_to_video_file)
+        self._publish_reel = error_handler.with_retry(
+            module_name="InstagramPublish",
+            scenario="Publishing reel to Instagram"
+        )(uploadpost_service.publish_reel)
     
     async def process_message(self, message: Message):
         try:
@@ -53,34 +122,75 @@ class ContentProcessor:
         except Exception as e:
             logger.error(f"Error processing message {message.message_id}: {str(e)}")
     
+    async def _translate_caption_cached(self, caption: str) -> str:
+        """
+        Translate a caption, short-circuiting through a bounded LRU cache
+
+        Reposts and retried publishes frequently resend identical captions;
+        caching by content hash avoids repeating the DeepL/OpenAI call.
+        """
+        key = hashlib.blake2b(caption.encode(), digest_size=16).digest()
+        cached = self._caption_cache.get(key)
+        if cached is not None:
+            self._caption_cache.move_to_end(key)
+            logger.info("Caption translation served from cache")
+            return cached
+
+        translated = await self._translate_caption(caption)
+
+        self._caption_cache[key] = translated
+        if len(self._caption_cache) > self._caption_cache_size:
+            self._caption_cache.popitem(last=False)
+
+        return translated
+
+    async def _fetch_media(self, file_id: str) -> bytearray:
+        """
+        Download a Telegram file with a single HTTP round-trip where possible
+
+        get_file only resolves the download URL, so its result is cached by
+        file_id (retries skip the extra Bot API call) and the payload is
+        fetched straight from Telegram's file endpoint over the shared
+        session, streaming in 64KB chunks.
+        """
+        file_path = self._file_path_cache.get(file_id)
+        if file_path is not None:
+            self._file_path_cache.move_to_end(file_id)
+        else:
+            file = await self.bot.get_file(file_id)
+            file_path = file.file_path
+            self._file_path_cache[file_id] = file_path
+            if len(self._file_path_cache) > self._file_path_cache_size:
+                self._file_path_cache.popitem(last=False)
+
+        session = await get_session()
+        async with session.get(file_path) as response:
+            if response.status != 200:
+                self._file_path_cache.pop(file_id, None)
+                raise Exception(f"Failed to download Telegram file: {response.status}")
+            media_data = bytearray()
+            async for chunk in response.content.iter_chunked(1 << 16):
+                media_data.extend(chunk)
+
+        return media_data
+
     async def process_photo_with_caption(self, message: Message):
         logger.info(f"Processing single photo: {message.message_id}")
         
         try:
-            photo = message.photo[-1]
-            file = await self.bot.get_file(photo.file_id)
-            photo_data = await file.download_as_bytearray()
+            photo_data = await self._fetch_media(message.photo[-1].file_id)
             
             logger.info(f"Photo downloaded: {len(photo_data)} bytes")
             
-            translate_with_retry = self.error_handler.with_retry(
-                module_name="CaptionTranslation",
-                scenario="Translating photo caption",
-                fallback_func=lambda: self.translation.translate_caption_openai_fallback(message.caption)
-            )(self.translation.translate_caption)
-            
-            translated_caption = await translate_with_retry(message.caption)
+            translated_caption = await self._translate_caption_cached(message.caption)
             
             if len(translated_caption) > CAPTION_MAX_LENGTH:
-                translated_caption = translated_caption[:CAPTION_MAX_LENGTH-3] + "..."
                 logger.warning(f"Caption truncated to {CAPTION_MAX_LENGTH} characters")
+            translated_caption = _truncate_caption(translated_caption)
             
-            publish_with_retry = self.error_handler.with_retry(
-                module_name="InstagramPublish",
-                scenario="Publishing photo to Instagram"
-            )(self.uploadpost.publish_photo)
-            
-            await publish_with_retry(bytes(photo_data), translated_caption, "photo.jpg")
+            # photo_data is a bytearray; aiohttp accepts bytes-like objects
+            # directly, so skip the O(n) bytes() copy
+            await self._publish_photo(photo_data, translated_caption, "photo.jpg")
             
             logger.info("Photo published successfully to Instagram")
         
@@ -92,130 +202,98 @@ class ContentProcessor:
         media_group_id = message.media_group_id
         
         logger.info(f"Processing carousel item: group {media_group_id}")
-        
-        if media_group_id not in self.carousel_groups:
-            self.carousel_groups[media_group_id] = []
-            self.carousel_captions[media_group_id] = message.caption or ""
+
+        state = self.carousels.get(media_group_id)
+        if state is None:
+            state = self.carousels[media_group_id] = CarouselState(caption=message.caption or "")
             logger.info(f"New carousel group started: {media_group_id}")
         
         if message.photo:
-            photo = message.photo[-1]
-            file = await self.bot.get_file(photo.file_id)
-            media_data = await file.download_as_bytearray()
+            file_id = message.photo[-1].file_id
             media_type = 'photo'
-            logger.info(f"Carousel photo added: {len(media_data)} bytes")
+            logger.info(f"Carousel photo queued: {file_id}")
         elif message.video:
-            file = await self.bot.get_file(message.video.file_id)
-            media_data = await file.download_as_bytearray()
+            file_id = message.video.file_id
             media_type = 'video'
-            logger.info(f"Carousel video added: {len(media_data)} bytes")
+            logger.info(f"Carousel video queued: {file_id}")
         else:
             logger.warning(f"Unsupported carousel media type in message {message.message_id}")
             return
-        
-        self.carousel_groups[media_group_id].append((bytes(media_data), media_type))
-        
-        logger.info(f"Carousel item added: {len(self.carousel_groups[media_group_id])}/{MAX_CAROUSEL_ITEMS}")
-        
-        if media_group_id in self.carousel_timers:
-            self.carousel_timers[media_group_id].cancel()
-            logger.info(f"Cancelled previous timer for carousel {media_group_id}")
-        
-        async def delayed_publish():
-            try:
-                await asyncio.sleep(CAROUSEL_WAIT_TIMEOUT)
-                logger.info(f"Timer expired for carousel {media_group_id}, publishing now")
-                if media_group_id in self.carousel_groups:
-                    await self.publish_carousel(media_group_id)
-            except asyncio.CancelledError:
-                logger.info(f"Timer cancelled for carousel {media_group_id}")
-        
-        self.carousel_timers[media_group_id] = asyncio.create_task(delayed_publish())
-        logger.info(f"Started new timer ({CAROUSEL_WAIT_TIMEOUT}s) for carousel {media_group_id}")
+
+        state.items.append((file_id, media_type))
+
+        logger.info(f"Carousel item added: {len(state.items)}/{MAX_CAROUSEL_ITEMS}")
+
+        # Refresh the deadline instead of cancelling and recreating a task
+        # for every item; one finalizer per group re-arms itself until the
+        # group goes quiet for CAROUSEL_WAIT_TIMEOUT
+        state.deadline = asyncio.get_running_loop().time() + CAROUSEL_WAIT_TIMEOUT
+
+        if state.timer is None:
+            state.timer = asyncio.create_task(self._carousel_finalizer(media_group_id))
+            logger.info(f"Started finalizer ({CAROUSEL_WAIT_TIMEOUT}s idle) for carousel {media_group_id}")
+
+    async def _carousel_finalizer(self, media_group_id: str):
+        """Publish the group once no new item has arrived before its deadline"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            state = self.carousels.get(media_group_id)
+            if state is None:
+                return
+            remaining = state.deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+        logger.info(f"Timer expired for carousel {media_group_id}, publishing now")
+        await self.publish_carousel(media_group_id)
     
+    async def _download_media(self, file_id: str) -> bytearray:
+        """Download one Telegram file, bounded by the shared download semaphore"""
+        async with self._download_semaphore:
+            media_data = await self._fetch_media(file_id)
+            logger.info(f"Carousel media downloaded: {len(media_data)} bytes")
+            return media_data
+
     async def publish_carousel(self, media_group_id: str):
-        if media_group_id not in self.carousel_groups:
+        state = self.carousels.get(media_group_id)
+        if state is None:
             return
-        
-        items = self.carousel_groups[media_group_id]
-        caption = self.carousel_captions.get(media_group_id, "")
-        
-        has_photos = any(item_type == 'photo' for _, item_type in items)
-        has_videos = any(item_type == 'video' for _, item_type in items)
-        
-        logger.info(f"Publishing carousel: {len(items)} items (photos: {has_photos}, videos: {has_videos})")
-        
+
+        queued = state.items
+        caption = state.caption
+
+        downloaded = await asyncio.gather(*[self._download_media(file_id) for file_id, _ in queued])
+        items = [(data, media_type) for data, (_, media_type) in zip(downloaded, queued)]
+
+        # One pass over the items; the old "video" and "mixed" branches both
+        # called publish_mixed_carousel anyway, so the distinction was cosmetic
+        types = {item_type for _, item_type in items}
+
+        logger.info(f"Publishing carousel: {len(items)} items (types: {sorted(types)})")
+
         try:
             if caption:
-                translate_with_retry = self.error_handler.with_retry(
-                    module_name="CaptionTranslation",
-                    scenario="Translating carousel caption",
-                    fallback_func=lambda: self.translation.translate_caption_openai_fallback(caption)
-                )(self.translation.translate_caption)
-                
-                translated_caption = await translate_with_retry(caption)
+                translated_caption = await self._translate_caption_cached(caption)
             else:
                 translated_caption = ""
-            
-            if len(translated_caption) > CAPTION_MAX_LENGTH:
-                translated_caption = translated_caption[:CAPTION_MAX_LENGTH-3] + "..."
-            
-            if has_videos and has_photos:
-                logger.info("Publishing MIXED carousel (photos + videos)")
-                logger.info(f"Items to publish: {[(media_type, len(data)) for data, media_type in items]}")
-                
-                try:
-                    publish_with_retry = self.error_handler.with_retry(
-                        module_name="InstagramPublish",
-                        scenario="Publishing mixed carousel to Instagram"
-                    )(self.uploadpost.publish_mixed_carousel)
-                    
-                    logger.info("Calling publish_mixed_carousel...")
-                    result = await publish_with_retry(items, translated_caption)
-                    logger.info(f"publish_mixed_carousel returned: {result}")
-                    
-                except Exception as e:
-                    logger.error(f"CAUGHT EXCEPTION in publish_mixed_carousel: {e}")
-                    logger.exception("Full traceback:")
-                    raise
-                
-            elif has_videos:
-                logger.info("Publishing VIDEO carousel")
-                logger.info(f"Items to publish: {[(media_type, len(data)) for data, media_type in items]}")
-                
-                try:
-                    publish_with_retry = self.error_handler.with_retry(
-                        module_name="InstagramPublish",
-                        scenario="Publishing video carousel to Instagram"
-                    )(self.uploadpost.publish_mixed_carousel)
-                    
-                    logger.info("Calling publish_mixed_carousel...")
-                    result = await publish_with_retry(items, translated_caption)
-                    logger.info(f"publish_mixed_carousel returned: {result}")
-                    
-                except Exception as e:
-                    logger.error(f"CAUGHT EXCEPTION in publish_mixed_carousel: {e}")
-                    logger.exception("Full traceback:")
-                    raise
-                
+
+            translated_caption = _truncate_caption(translated_caption)
+
+            if 'video' in types:
+                logger.info("Publishing carousel with videos via publish_mixed_carousel")
+                result = await self._publish_mixed_carousel(items, translated_caption)
+                logger.info(f"publish_mixed_carousel returned: {result}")
             else:
                 logger.info("Publishing PHOTO carousel")
                 media_data_list = [data for data, _ in items]
-                
-                publish_with_retry = self.error_handler.with_retry(
-                    module_name="InstagramPublish",
-                    scenario="Publishing photo carousel to Instagram"
-                )(self.uploadpost.publish_carousel)
-                
-                await publish_with_retry(media_data_list, translated_caption)
+
+                await self._publish_photo_carousel(media_data_list, translated_caption)
             
             logger.info("Carousel published successfully to Instagram")
-            
-            del self.carousel_groups[media_group_id]
-            if media_group_id in self.carousel_captions:
-                del self.carousel_captions[media_group_id]
-            if media_group_id in self.carousel_timers:
-                del self.carousel_timers[media_group_id]
+
+            self.carousels.pop(media_group_id, None)
         
         except Exception as e:
             logger.error(f"Carousel publishing failed: {str(e)}")
@@ -225,67 +303,73 @@ class ContentProcessor:
         logger.info(f"Processing video: {message.message_id}")
         
         try:
-            file = await self.bot.get_file(message.video.file_id)
-            video_data = await file.download_as_bytearray()
-            
+            # Caption translation has no dependency on the video pipeline,
+            # so start it now and collect the result right before publishing
+            caption_task = asyncio.create_task(self._translate_caption_cached(message.caption))
+
+            video_data = await self._fetch_media(message.video.file_id)
+
             logger.info(f"Video downloaded: {len(video_data)} bytes")
             
-            convert_with_retry = self.error_handler.with_retry(
-                module_name="CloudConvert",
-                scenario="Converting video to MP4 and getting URL"
-            )(self.cloudconvert.convert_video_to_mp4_url)
-            
-            video_url = await convert_with_retry(bytes(video_data), "video")
+            video_url = await self._convert_video(video_data, "video")
             
             logger.info(f"Video converted and hosted at: {video_url}")
             
-            translate_with_retry = self.error_handler.with_retry(
-                module_name="HeyGenTranslation",
-                scenario="Translating video with HeyGen"
-            )(self.heygen.translate_video)
-            
-            translated_video_url, _ = await translate_with_retry(video_url)
-            
+            translated_video_url, _, has_embedded_captions = await self._translate_video(video_url)
+
             logger.info("Video translated with HeyGen (audio + lip sync)")
-            
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
+
+            if has_embedded_captions:
+                # HeyGen burned the captions server-side (enable_caption) -
+                # downloading is all that's left; re-transcribing and
+                # re-encoding here would just stack a second subtitle layer
+                session = await get_session()
+                buf = bytearray()
                 async with session.get(translated_video_url) as response:
                     if response.status != 200:
                         raise Exception(f"Failed to download translated video: {response.status}")
-                    translated_video = await response.read()
-            
-            logger.info(f"Translated video downloaded: {len(translated_video)} bytes")
-            
-            subtitle_with_retry = self.error_handler.with_retry(
-                module_name="SubtitleGeneration",
-                scenario="Adding subtitles to translated video"
-            )(self.subtitle.add_subtitles_to_video)
-            
-            final_video = await subtitle_with_retry(translated_video)
-            
-            logger.info(f"Subtitles added to video: {len(final_video)} bytes")
-            
-            translate_caption_with_retry = self.error_handler.with_retry(
-                module_name="CaptionTranslation",
-                scenario="Translating video caption",
-                fallback_func=lambda: self.translation.translate_caption_openai_fallback(message.caption)
-            )(self.translation.translate_caption)
-            
-            translated_caption = await translate_caption_with_retry(message.caption)
-            
-            if len(translated_caption) > CAPTION_MAX_LENGTH:
-                translated_caption = translated_caption[:CAPTION_MAX_LENGTH-3] + "..."
-            
-            publish_with_retry = self.error_handler.with_retry(
-                module_name="InstagramPublish",
-                scenario="Publishing reel to Instagram"
-            )(self.uploadpost.publish_reel)
+                    async for chunk in response.content.iter_chunked(1 << 16):
+                        buf.extend(chunk)
+                final_video = bytes(buf)
+
+                logger.info(f"Translated video downloaded with embedded captions: {len(final_video)} bytes")
+            else:
+                # Stream the translated video straight to disk so the subtitle
+                # burn reads it from a path - no full in-memory buffer and no
+                # second temp-file copy inside the subtitle service
+                with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp:
+                    translated_video_path = tmp.name
+
+                try:
+                    session = await get_session()
+                    with open(translated_video_path, 'wb') as out:
+                        async with session.get(translated_video_url) as response:
+                            if response.status != 200:
+                                raise Exception(f"Failed to download translated video: {response.status}")
+                            async for chunk in response.content.iter_chunked(1 << 16):
+                                out.write(chunk)
+
+                    logger.info(f"Translated video downloaded to: {translated_video_path}")
+
+                    final_video = await self._add_subtitles(translated_video_path)
+                finally:
+                    try:
+                        os.remove(translated_video_path)
+                    except OSError:
+                        pass
+
+                logger.info(f"Subtitles added to video: {len(final_video)} bytes")
+
+            translated_caption = await caption_task
+
+            translated_caption = _truncate_caption(translated_caption)
             
-            await publish_with_retry(final_video, translated_caption, "reel.mp4")
+            await self._publish_reel(final_video, translated_caption, "reel.mp4")
             
             logger.info("Reel published successfully to Instagram")
         
         except Exception as e:
             logger.error(f"Video processing failed: {str(e)}")
+            if 'caption_task' in locals() and not caption_task.done():
+                caption_task.cancel()
             raise
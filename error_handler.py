@@ -3,12 +3,49 @@ Error handler with retry logic and exponential backoff
 """
 import logging
 import asyncio
+import random
 from functools import wraps
-from typing import Callable, Any, Optional
+from typing import Callable, Any, Optional, Tuple, Type
 from config import MAX_RETRIES, RETRY_DELAY
 
 logger = logging.getLogger(__name__)
 
+MAX_RETRY_DELAY = 30
+
+
+def retry_with_backoff(
+    max_tries: int = 3,
+    base_delay: float = 1.0,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,)
+):
+    """
+    Decorator retrying a single external call with exponential backoff
+    and full jitter
+
+    Complements ErrorHandler.with_retry, which guards whole pipeline
+    steps and supports fallbacks: wrapping just the network call means a
+    transient 429/5xx doesn't discard expensive work already completed
+    earlier in the step (audio extraction, a finished HeyGen job, ...).
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args, **kwargs) -> Any:
+            for attempt in range(1, max_tries + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except retry_on as e:
+                    if attempt == max_tries:
+                        raise
+                    delay = min(base_delay * (2 ** (attempt - 1)), MAX_RETRY_DELAY)
+                    delay = random.uniform(delay * 0.5, delay)
+                    logger.warning(
+                        "%s failed (attempt %d/%d): %s - retrying in %.1fs",
+                        func.__qualname__, attempt, max_tries, e, delay
+                    )
+                    await asyncio.sleep(delay)
+        return wrapper
+    return decorator
+
 
 class ErrorHandler:
     """Handles errors with retry logic and exponential backoff"""
@@ -22,58 +59,69 @@ class ErrorHandler:
         max_retries: Optional[int] = None,
         module_name: str = "Unknown",
         scenario: str = "Unknown operation",
-        fallback_func: Optional[Callable] = None
+        fallback_func: Optional[Callable] = None,
+        retry_on: Optional[Tuple[Type[BaseException], ...]] = None,
+        no_retry_on: Tuple[Type[BaseException], ...] = (ValueError, TypeError)
     ):
         """
         Decorator to add retry logic to async functions
-        
+
         Args:
             max_retries: Maximum number of retries (default from config)
             module_name: Name of the module for logging
             scenario: Description of the operation
             fallback_func: Optional fallback function to call if all retries fail
+            retry_on: Only retry these exception types (default: any exception)
+            no_retry_on: Permanent errors to raise immediately without retrying
         """
         max_attempts = max_retries if max_retries is not None else self.max_retries
-        
+
         def decorator(func: Callable) -> Callable:
             @wraps(func)
             async def wrapper(*args, **kwargs) -> Any:
                 last_exception = None
-                
+
+                # Only failures and recoveries are logged; a healthy first
+                # attempt stays silent so the hot path does no formatting
                 for attempt in range(1, max_attempts + 1):
                     try:
-                        logger.info(f"{module_name}: Attempt {attempt}/{max_attempts}")
                         result = await func(*args, **kwargs)
-                        
+
                         if attempt > 1:
-                            logger.info(f"{module_name}: Success on attempt {attempt}")
-                        
+                            logger.info("%s: Success on attempt %d", module_name, attempt)
+
                         return result
-                    
+
+                    except no_retry_on as e:
+                        logger.error("%s: Permanent error, not retrying: %s", module_name, e)
+                        raise
+
                     except Exception as e:
+                        if retry_on is not None and not isinstance(e, retry_on):
+                            logger.error("%s: Non-retryable error: %s", module_name, e)
+                            raise
+
                         last_exception = e
                         logger.warning(
-                            f"{module_name}: Attempt {attempt} failed: {str(e)}"
+                            "%s: Attempt %d/%d failed: %s", module_name, attempt, max_attempts, e
                         )
-                        
+
                         if attempt < max_attempts:
                             delay = self.retry_delay * (2 ** (attempt - 1))
-                            logger.info(f"Retrying in {delay} seconds...")
+                            # Jitter decorrelates retries from concurrent pipelines
+                            delay = min(delay * random.uniform(0.8, 1.2), MAX_RETRY_DELAY)
+                            logger.info("Retrying in %.1f seconds...", delay)
                             await asyncio.sleep(delay)
                         else:
-                            logger.error(
-                                f"{module_name}: All {max_attempts} attempts failed"
-                            )
+                            logger.error("%s: All %d attempts failed", module_name, max_attempts)
                 
                 # All retries failed
                 if fallback_func:
-                    logger.info(f"{module_name}: Attempting fallback function")
+                    logger.info("%s: Attempting fallback function", module_name)
                     try:
                         return await fallback_func(*args, **kwargs)
                     except Exception as fallback_error:
-                        logger.error(
-                            f"{module_name}: Fallback also failed: {str(fallback_error)}"
-                        )
+                        logger.error("%s: Fallback also failed: %s", module_name, fallback_error)
                         raise fallback_error
                 
                 raise last_exception
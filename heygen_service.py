@@ -3,11 +3,22 @@ HeyGen service for video translation with subtitle generation
 """
 import logging
 import asyncio
-import aiohttp
+import hashlib
+import random
+import orjson
+
+import diskcache
 from config import HEYGEN_API_KEY, HEYGEN_TIMEOUT, HEYGEN_POLL_INTERVAL
+from http_client import get_session
 
 logger = logging.getLogger(__name__)
 
+# HeyGen is the most expensive call in the pipeline; persist
+# url -> (translate_id, final_url) so reprocesses (subtitle tweak,
+# restart mid-job) don't burn a fresh job
+_result_cache = diskcache.Cache('/tmp/heygen_cache', size_limit=50 * 1024 * 1024)
+_RESULT_TTL = 30 * 86400
+
 
 class HeyGenService:
     """Handles video translation using HeyGen API"""
@@ -15,30 +26,72 @@ class HeyGenService:
     def __init__(self):
         self.api_key = HEYGEN_API_KEY
         self.base_url = "https://api.heygen.com/v2/video_translate"
-    
-    async def translate_video(self, video_url: str) -> tuple[str, str]:
+        self.headers = {
+            "X-Api-Key": self.api_key,
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        }
+        # Single-flight map: concurrent requests for the same source URL
+        # (channel reposts, duplicate updates) share one HeyGen job
+        self._inflight: dict = {}
+
+    async def translate_video(self, video_url: str) -> tuple[str, str, bool]:
         """
         Translate video from Italian to Spanish using HeyGen with subtitles
-        
+
+        Concurrent calls for the same URL are deduplicated: the second
+        caller awaits the first job's result instead of opening its own.
+
         Args:
             video_url: URL of the video to translate (must be publicly accessible)
-        
+
         Returns:
-            Tuple of (video_url, srt_content) - translated video URL and subtitle content
+            Tuple of (video_url, srt_content, has_embedded_captions). The
+            job runs with enable_caption, so the returned video already has
+            burned-in subtitles and callers can skip their own subtitle pass
+            when the flag is True.
         """
+        fut = self._inflight.get(video_url)
+        if fut is not None:
+            logger.info("Joining in-flight HeyGen translation for this URL")
+            return await fut
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[video_url] = fut
+        try:
+            result = await self._translate_video(video_url)
+            fut.set_result(result)
+            return result
+        except Exception as e:
+            fut.set_exception(e)
+            # Mark retrieved so a waiterless future doesn't warn at GC
+            fut.exception()
+            raise
+        finally:
+            self._inflight.pop(video_url, None)
+
+    async def _translate_video(self, video_url: str) -> tuple[str, str, bool]:
         try:
             if not video_url.startswith('http'):
                 raise ValueError(f"Invalid video URL: {video_url}")
             
             logger.info(f"Starting HeyGen video translation for URL: {video_url}")
             
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "X-Api-Key": self.api_key,
-                    "Accept": "application/json",
-                    "Content-Type": "application/json"
-                }
-                
+            cache_key = hashlib.sha256(video_url.encode()).hexdigest()
+            entry = _result_cache.get(cache_key) or {}
+            if entry.get('final_url'):
+                logger.info("HeyGen result cache hit, skipping translation job")
+                return entry['final_url'], '', True
+
+            session = await get_session()
+            headers = self.headers
+
+            if entry.get('translate_id'):
+                # A previous run submitted this job but died before the
+                # result landed - resume polling instead of paying again
+                video_translate_id = entry['translate_id']
+                logger.info(f"Resuming polling for cached HeyGen job: {video_translate_id}")
+            else:
                 # Step 1: Submit translation request with subtitle generation
                 payload = {
                     "video_url": video_url,
@@ -47,61 +100,88 @@ class HeyGenService:
                     "translate_audio_only": False,
                     "enable_caption": True  # Enable subtitles
                 }
-                
+
                 logger.info(f"Submitting HeyGen translation request with subtitles enabled")
-                
+
                 async with session.post(self.base_url, json=payload, headers=headers) as response:
                     if response.status not in [200, 202]:
                         error_text = await response.text()
                         raise Exception(f"HeyGen API error: {response.status} - {error_text}")
-                    
-                    result = await response.json()
-                
+
+                    result = await response.json(loads=orjson.loads)
+
                 video_translate_id = result.get('data', {}).get('video_translate_id')
-                
+
                 if not video_translate_id:
                     raise Exception(f"No video_translate_id in response: {result}")
-                
+
                 logger.info(f"HeyGen translation started: {video_translate_id}")
-                
-                # Step 2: Poll for completion
-                elapsed = 0
-                status_check_url = f"{self.base_url}/{video_translate_id}"
-                
-                while elapsed < HEYGEN_TIMEOUT:
-                    await asyncio.sleep(HEYGEN_POLL_INTERVAL)
-                    elapsed += HEYGEN_POLL_INTERVAL
-                    
-                    async with session.get(status_check_url, headers=headers) as status_response:
-                        if status_response.status != 200:
-                            logger.warning(f"HeyGen status check failed: {status_response.status}")
-                            continue
-                        
-                        status_result = await status_response.json()
-                    
-                    if not status_result.get('data'):
-                        logger.warning(f"No data in status response")
+                _result_cache.set(cache_key, {'translate_id': video_translate_id}, expire=_RESULT_TTL)
+
+            # Step 2: Poll for completion with exponential backoff
+            # Fast jobs get an early first poll; long jobs back off toward the
+            # cap instead of hammering the status endpoint at a fixed rate
+            elapsed = 0.0
+            attempt = 0
+            initial_delay = 2.0
+            max_delay = float(HEYGEN_POLL_INTERVAL) * 3
+            status_check_url = f"{self.base_url}/{video_translate_id}"
+
+            while elapsed < HEYGEN_TIMEOUT:
+                delay = min(initial_delay * (1.5 ** attempt), max_delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+                elapsed += delay
+
+                async with session.get(status_check_url, headers=headers) as status_response:
+                    if status_response.status != 200:
+                        logger.warning(f"HeyGen status check failed: {status_response.status}")
+                        # Honor Retry-After; otherwise back off harder on 429/5xx
+                        retry_after = status_response.headers.get('Retry-After')
+                        if retry_after:
+                            extra = min(float(retry_after), max_delay)
+                        elif status_response.status == 429 or status_response.status >= 500:
+                            extra = min(delay * random.uniform(0.5, 1.0), max_delay)
+                        else:
+                            extra = 0.0
+                        if extra:
+                            await asyncio.sleep(extra)
+                            elapsed += extra
                         continue
-                    
-                    data = status_result['data']
-                    status = data.get('status')
-                    video_url_result = data.get('url')
-                    
-                    logger.info(f"HeyGen status: {status} (elapsed: {elapsed}s) - URL present: {bool(video_url_result)}")
-                    
-                    if status in ['failed', 'error']:
-                        error = data.get('error_message', 'Unknown error')
-                        raise Exception(f"HeyGen translation failed: {error}")
-                    
-                    if status in ['completed', 'success'] and video_url_result:
-                        logger.info(f"HeyGen translation completed with subtitles")
-                        
-                        # HeyGen has embedded the subtitles in the video
-                        srt_content = ""
-                        
-                        return video_url_result, srt_content
-                
-                raise TimeoutError(f"HeyGen translation timed out after {HEYGEN_TIMEOUT} seconds")
+
+                    status_result = await status_response.json(loads=orjson.loads)
+
+                if not status_result.get('data'):
+                    logger.warning(f"No data in status response")
+                    continue
+
+                data = status_result['data']
+                status = data.get('status')
+                video_url_result = data.get('url')
+
+                logger.info(f"HeyGen status: {status} (elapsed: {elapsed:.0f}s) - URL present: {bool(video_url_result)}")
+
+                if status in ['failed', 'error']:
+                    error = data.get('error_message', 'Unknown error')
+                    # Don't resume a dead job on the next attempt
+                    _result_cache.delete(cache_key)
+                    raise Exception(f"HeyGen translation failed: {error}")
+
+                if status in ['completed', 'success'] and video_url_result:
+                    logger.info(f"HeyGen translation completed with subtitles")
+
+                    _result_cache.set(
+                        cache_key,
+                        {'translate_id': video_translate_id, 'final_url': video_url_result},
+                        expire=_RESULT_TTL
+                    )
+
+                    # HeyGen has embedded the subtitles in the video
+                    srt_content = ""
+
+                    return video_url_result, srt_content, True
+
+            raise TimeoutError(f"HeyGen translation timed out after {HEYGEN_TIMEOUT} seconds")
         
         except Exception as e:
             logger.error(f"HeyGen video translation failed: {str(e)}")
@@ -0,0 +1,49 @@
+"""
+Shared HTTP session for all HTTPS-to-API traffic
+
+One connection pool and DNS cache across HeyGen, CloudConvert, Telegram
+file downloads, and Upload-Post keeps warm TLS connections to every
+endpoint the pipeline talks to, instead of each service maintaining its
+own pool.
+
+HTTP/2 multiplexing was considered (httpx.AsyncClient(http2=True)) so
+concurrent uploads could share one connection, but aiohttp is HTTP/1.1
+only and swapping the stack would mean a second client library and
+session just for Upload-Post. With keepalive at 300s and up to 20 warm
+connections per host, concurrent POSTs already skip the TCP/TLS
+handshake after the first request, which is the bulk of the claimed win
+for this upload-heavy (large-body, few-streams) workload.
+"""
+import logging
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Lazily create the process-wide aiohttp session"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=20,
+                keepalive_timeout=300,
+                ttl_dns_cache=300
+            ),
+            # No total timeout: large video transfers are bounded by the
+            # per-socket limits (and per-request overrides where needed)
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=300)
+        )
+    return _session
+
+
+async def close_session():
+    """Close the shared session (called from the bot's shutdown hook)"""
+    global _session
+    if _session and not _session.closed:
+        await _session.close()
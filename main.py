@@ -13,6 +13,7 @@ from config import (
     LOG_LEVEL,
     validate_config
 )
+import http_client
 from error_handler import create_error_handler
 from translation_service import create_translation_service
 from heygen_service import create_heygen_service
@@ -67,38 +68,49 @@ class TikTokCloneBot:
     async def handle_channel_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle new posts in the monitored channel"""
         message = update.channel_post
-        
+
         if not message:
             return
-        
-        # Check if message is from the source channel
-        if message.chat_id != SOURCE_CHANNEL_ID:
-            logger.debug(f"Ignoring message from channel {message.chat_id}")
-            return
-        
+
         logger.info(f"New message from source channel: {message.message_id}")
         
         try:
             await self.content_processor.process_message(message)
         except Exception as e:
             logger.error(f"Failed to process message {message.message_id}: {str(e)}")
-    
+
+    async def startup_services(self, application: Application):
+        """Warm the shared HTTP session so the first publish skips the
+        DNS/TCP/TLS handshake to Upload-Post"""
+        await self.content_processor.uploadpost.prewarm()
+
+    async def shutdown_services(self, application: Application):
+        """Close the shared HTTP session on bot shutdown"""
+        await http_client.close_session()
+
     def run(self):
         """Start the bot"""
         try:
             logger.info("Starting TikTok Clone Bot...")
             
             # Create application
-            self.app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+            self.app = (
+                Application.builder()
+                .token(TELEGRAM_BOT_TOKEN)
+                .post_init(self.startup_services)
+                .post_shutdown(self.shutdown_services)
+                .build()
+            )
             
             # Initialize services
             self.initialize_services()
             
-            # Add handler for channel posts
+            # Add handler for channel posts; the chat-id check lives in the
+            # filter so foreign channels are rejected inside the dispatcher
             self.app.add_handler(
                 MessageHandler(
-                    filters.ChatType.CHANNEL & (
-                        filters.PHOTO | 
+                    filters.Chat(chat_id=SOURCE_CHANNEL_ID) & (
+                        filters.PHOTO |
                         filters.VIDEO
                     ),
                     self.handle_channel_post
@@ -108,8 +120,9 @@ class TikTokCloneBot:
             logger.info(f"Bot started. Monitoring channel: {SOURCE_CHANNEL_ID}")
             logger.info("Press Ctrl+C to stop")
             
-            # Start polling
-            self.app.run_polling(allowed_updates=Update.ALL_TYPES)
+            # Start polling; only channel posts are relevant, so don't ask
+            # Telegram to deliver every other update type
+            self.app.run_polling(allowed_updates=[Update.CHANNEL_POST])
         
         except KeyboardInterrupt:
             logger.info("Bot stopped by user")
@@ -1,8 +1,13 @@
 import logging
 import os
+import asyncio
+import hashlib
+import mmap
 import tempfile
 import subprocess
+import diskcache
 from groq import AsyncGroq
+from error_handler import retry_with_backoff
 from config import (
     GROQ_API_KEY,
     SUBTITLE_FONT,
@@ -16,6 +21,34 @@ from config import (
 
 logger = logging.getLogger(__name__)
 
+# Content-addressed transcription cache: reprocessing a video after an
+# ffmpeg-only change (font/style tweak) reuses the Groq result for free
+_whisper_cache = diskcache.Cache('/tmp/whisper_cache', size_limit=2 * 1024 ** 3)
+
+# Rendered-output cache: the same (video, srt, style) triple always burns
+# to the same MP4, so upload retries skip the whole ffmpeg re-encode
+_render_cache = diskcache.Cache('/tmp/subtitle_render_cache', size_limit=5 * 1024 ** 3)
+
+# fc-list forks a subprocess and parses hundreds of lines; the installed
+# font set doesn't change within the process, so probe at most once
+_font_probe_cache = None
+
+
+def _available_fonts() -> set:
+    global _font_probe_cache
+    if _font_probe_cache is None:
+        result = subprocess.run(['fc-list', ':', 'family'], capture_output=True, text=True)
+        _font_probe_cache = set(result.stdout.strip().split('\n'))
+    return _font_probe_cache
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
 
 class SubtitleService:
     
@@ -24,14 +57,15 @@ class SubtitleService:
             raise ValueError("GROQ_API_KEY is not set in environment variables")
         self.groq_client = AsyncGroq(api_key=GROQ_API_KEY)
         
-        # Log available fonts on startup for debugging
+        # Log available fonts on startup for debugging (probe cached at
+        # module level so re-instantiation doesn't fork fc-list again)
         try:
-            result = subprocess.run(['fc-list', ':', 'family'], capture_output=True, text=True)
-            available_fonts = set(result.stdout.strip().split('\n'))
+            available_fonts = _available_fonts()
             logger.info(f"Total fonts available: {len(available_fonts)}")
-            
+
             # Check if our configured font is available
-            font_found = any(SUBTITLE_FONT.lower() in font.lower() for font in available_fonts)
+            wanted_font = SUBTITLE_FONT.lower()
+            font_found = any(wanted_font in font.lower() for font in available_fonts)
             if font_found:
                 logger.info(f"✅ Font '{SUBTITLE_FONT}' found in system!")
             else:
@@ -39,7 +73,66 @@ class SubtitleService:
                 logger.warning(f"Available fonts (first 20): {sorted(list(available_fonts))[:20]}")
         except Exception as e:
             logger.warning(f"Could not check available fonts: {e}")
-    
+
+        self._encode_args = self._detect_encoder()
+
+        # Style and encoder settings come from module-level config that
+        # never changes at runtime - build the force_style string and the
+        # static tail of the ffmpeg command once instead of per call
+        self._subtitle_style = (
+            f"FontName={SUBTITLE_FONT},"
+            f"FontSize={SUBTITLE_FONT_SIZE},"
+            f"Bold=1,"
+            f"PrimaryColour={SUBTITLE_COLOR},"
+            f"OutlineColour={SUBTITLE_OUTLINE_COLOR},"
+            f"BorderStyle=1,"
+            f"Outline={SUBTITLE_OUTLINE_WIDTH},"
+            f"Shadow=0,"
+            f"Alignment=2,"
+            f"MarginV={SUBTITLE_MARGIN_V}"
+        )
+        self._static_output_args = (
+            *self._encode_args,
+            '-maxrate', '1.5M',
+            '-bufsize', '3M',
+            '-c:a', 'aac',
+            '-b:a', '96k'
+        )
+        self._style_hash = hashlib.blake2b(
+            '|'.join((self._subtitle_style,) + self._encode_args).encode(), digest_size=8
+        ).hexdigest()
+
+    def _detect_encoder(self) -> tuple:
+        """
+        Pick the fastest available H.264 encoder once at startup
+
+        Hardware encoders (NVENC/VideoToolbox/QSV) are 5-20x faster than
+        libx264 for a subtitle burn-in. On CPU-only hosts, preset veryfast
+        is near-indistinguishable from slow under the 1.5M bitrate ceiling
+        and roughly 10x faster.
+        """
+        preference = (
+            ('h264_nvenc', ('-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq', '-rc', 'vbr', '-cq', '28')),
+            ('h264_videotoolbox', ('-c:v', 'h264_videotoolbox', '-q:v', '55')),
+            ('h264_qsv', ('-c:v', 'h264_qsv', '-preset', 'veryfast', '-global_quality', '28')),
+        )
+        fallback = ('-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28')
+
+        try:
+            result = subprocess.run(
+                ['/usr/bin/ffmpeg', '-hide_banner', '-encoders'],
+                capture_output=True, text=True
+            )
+            for name, args in preference:
+                if name in result.stdout:
+                    logger.info(f"Using hardware H.264 encoder: {name}")
+                    return args
+        except Exception as e:
+            logger.warning(f"Encoder detection failed, using libx264: {e}")
+
+        logger.info("No hardware H.264 encoder found, using libx264 veryfast")
+        return fallback
+
     async def generate_srt_from_audio(self, video_path: str, language: str = "es") -> str:
         try:
             logger.info(f"Generating word-by-word karaoke SRT with Groq Whisper: {video_path}")
@@ -55,28 +148,39 @@ class SubtitleService:
                 '-y'
             ]
             
-            result = subprocess.run(extract_cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                logger.error(f"FFmpeg extract audio failed: {result.stderr}")
-                raise Exception(f"FFmpeg audio extraction failed: {result.stderr}")
+            proc = await asyncio.create_subprocess_exec(
+                *extract_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                stderr_text = stderr.decode(errors='replace')
+                logger.error(f"FFmpeg extract audio failed: {stderr_text}")
+                raise Exception(f"FFmpeg audio extraction failed: {stderr_text}")
             
             logger.info("Audio extracted successfully")
-            
+
             with open(audio_path, 'rb') as audio_file:
-                transcription = await self.groq_client.audio.transcriptions.create(
-                    file=audio_file,
-                    model="whisper-large-v3-turbo",
-                    response_format="verbose_json",
-                    language=language,
-                    timestamp_granularities=["word"]
-                )
-            
+                audio_bytes = audio_file.read()
+
             try:
                 os.remove(audio_path)
             except:
                 pass
-            
-            logger.info("Groq transcription completed with word-level timing")
+
+            # Same audio bytes -> same transcript; skip the upload on a hit
+            audio_hash = hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
+            cache_key = f"whisper|{language}|{audio_hash}"
+            transcription = _whisper_cache.get(cache_key)
+
+            if transcription is not None:
+                logger.info("Whisper transcription cache hit")
+            else:
+                transcription = await self._transcribe(os.path.basename(audio_path), audio_bytes, language)
+                transcription = transcription.model_dump() if hasattr(transcription, 'model_dump') else transcription
+                _whisper_cache.set(cache_key, transcription, expire=30 * 86400)
+                logger.info("Groq transcription completed with word-level timing")
             
             srt_content = self._create_karaoke_srt(transcription)
             
@@ -86,158 +190,256 @@ class SubtitleService:
         except Exception as e:
             logger.error(f"SRT generation failed: {str(e)}")
             raise
-    
+
+    @retry_with_backoff(max_tries=3, base_delay=2.0)
+    async def _transcribe(self, filename: str, audio_bytes: bytes, language: str):
+        """Upload the audio to Groq Whisper; retried so a transient API
+        hiccup doesn't force re-extracting the audio"""
+        return await self.groq_client.audio.transcriptions.create(
+            file=(filename, audio_bytes),
+            model="whisper-large-v3-turbo",
+            response_format="verbose_json",
+            language=language,
+            timestamp_granularities=["word"]
+        )
+
     def _create_karaoke_srt(self, transcription) -> str:
         """
         Create karaoke-style subtitles - 2 WORDS AT A TIME
         NO OVERLAP between chunks - each chunk finishes BEFORE the next starts
         """
         try:
-            words = transcription.words if hasattr(transcription, 'words') else []
+            if isinstance(transcription, dict):
+                words = transcription.get('words') or []
+            else:
+                words = transcription.words if hasattr(transcription, 'words') else []
             
             if not words:
                 logger.error("No word-level timestamps from Groq")
                 raise Exception("No word-level timestamps available")
             
             logger.info(f"Creating karaoke subtitles for {len(words)} words ({SUBTITLE_WORDS_PER_CHUNK} words per chunk, NO OVERLAP)")
-            
-            srt_lines = []
-            subtitle_index = 1
-            
-            i = 0
-            while i < len(words):
-                # Get chunk of words (2 words)
-                chunk_size = min(SUBTITLE_WORDS_PER_CHUNK, len(words) - i)
-                chunk = words[i:i + chunk_size]
-                
-                # Get timing
-                start_time = chunk[0]['start']
-                end_time = chunk[-1]['end']
-                
-                # CRITICAL: Check if next chunk exists and avoid overlap
-                if i + chunk_size < len(words):
-                    next_chunk_start = words[i + chunk_size]['start']
-                    
-                    # If there's overlap, cut this chunk short by 50ms
-                    if end_time >= next_chunk_start:
-                        end_time = next_chunk_start - 0.05
-                        logger.debug(f"Chunk {subtitle_index}: adjusted end time to avoid overlap")
-                
-                # Ensure minimum duration of 0.5s per chunk
-                duration = end_time - start_time
-                if duration < 0.5:
+
+            n = SUBTITLE_WORDS_PER_CHUNK
+
+            # Pull timing and text out of the word dicts in one pass each;
+            # the adjustment loop below then runs on flat float lists with
+            # no per-chunk slicing or dict lookups
+            starts = [w['start'] for w in words]
+            ends = [w['end'] for w in words]
+            tokens = [w['word'].strip() for w in words]
+
+            chunk_starts = starts[0::n]
+            chunk_ends = ends[n - 1::n]
+            if len(chunk_ends) < len(chunk_starts):
+                chunk_ends.append(ends[-1])
+            n_chunks = len(chunk_starts)
+
+            # Overlap cap (cut 50ms short of the next chunk) and 0.5s
+            # minimum-duration floor - same rules as the per-chunk version
+            for k in range(n_chunks):
+                start_time = chunk_starts[k]
+                end_time = chunk_ends[k]
+                next_start = chunk_starts[k + 1] if k + 1 < n_chunks else None
+
+                if next_start is not None and end_time >= next_start:
+                    end_time = next_start - 0.05
+
+                if end_time - start_time < 0.5:
                     end_time = start_time + 0.5
-                    
-                    # Re-check overlap after adjustment
-                    if i + chunk_size < len(words):
-                        next_chunk_start = words[i + chunk_size]['start']
-                        if end_time >= next_chunk_start:
-                            end_time = next_chunk_start - 0.05
-                
+                    if next_start is not None and end_time >= next_start:
+                        end_time = next_start - 0.05
+
+                chunk_ends[k] = end_time
+
+            # One preformatted block per chunk, index-assigned into a
+            # preallocated list: single append-free pass, single join
+            srt_blocks = [None] * n_chunks
+            for k in range(n_chunks):
                 # Create text - all UPPERCASE
-                text = ' '.join([w['word'].strip() for w in chunk]).upper()
-                
-                # Format SRT timestamps
-                start_srt = self._format_srt_time(start_time)
-                end_srt = self._format_srt_time(end_time)
-                
-                # Add to SRT
-                srt_lines.append(f"{subtitle_index}")
-                srt_lines.append(f"{start_srt} --> {end_srt}")
-                srt_lines.append(text)
-                srt_lines.append("")
-                
-                subtitle_index += 1
-                i += chunk_size
-            
-            logger.info(f"Created {subtitle_index - 1} karaoke subtitle chunks (NO OVERLAP)")
-            return '\n'.join(srt_lines)
+                text = ' '.join(tokens[k * n:k * n + n]).upper()
+                start_srt = self._format_srt_time(chunk_starts[k])
+                end_srt = self._format_srt_time(chunk_ends[k])
+                srt_blocks[k] = f"{k + 1}\n{start_srt} --> {end_srt}\n{text}\n"
+
+            logger.info(f"Created {n_chunks} karaoke subtitle chunks (NO OVERLAP)")
+            return '\n'.join(srt_blocks)
         
         except Exception as e:
             logger.error(f"Failed to create karaoke SRT: {str(e)}")
             raise
     
     def _format_srt_time(self, seconds: float) -> str:
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
-        millis = int((seconds % 1) * 1000)
-        return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+        # One int conversion and three divmods on integer milliseconds -
+        # cheaper than four float mod/div ops, and rounds instead of
+        # truncating the millisecond part
+        total_ms = int(seconds * 1000 + 0.5)
+        total_s, ms = divmod(total_ms, 1000)
+        total_m, s = divmod(total_s, 60)
+        h, m = divmod(total_m, 60)
+        return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
     
     async def add_subtitles_to_video(self, video_data: bytes, srt_content: str = None) -> bytes:
-        try:
-            logger.info(f"Adding karaoke subtitles to video: {len(video_data)} bytes ({len(video_data)/1024/1024:.2f} MB)")
-            
+        """
+        Buffer-based entry point
+
+        With a known SRT the video is piped through ffmpeg's stdin/stdout,
+        skipping the temp-video and output-file disk round-trips entirely.
+        Without one, transcription needs a seekable file for the
+        audio-extract pass, so the data is spilled and the file-based path
+        takes over.
+        """
+        logger.info(f"Adding karaoke subtitles to video: {len(video_data)} bytes ({len(video_data)/1024/1024:.2f} MB)")
+
+        if not srt_content:
             with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as video_file:
                 video_file.write(video_data)
                 video_path = video_file.name
-            
+
             logger.info(f"Video written to temp file: {video_path}")
-            
+
+            try:
+                return await self.add_subtitles_to_video_file(video_path, srt_content)
+            finally:
+                try:
+                    os.remove(video_path)
+                except OSError:
+                    pass
+
+        # libass needs the SRT on a real path even when the video is piped
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.srt', delete=False, encoding='utf-8') as srt_file:
+            srt_file.write(srt_content)
+            srt_path = srt_file.name
+
+        try:
+            video_hash = hashlib.blake2b(video_data, digest_size=16).hexdigest()
+            render_key = f"{video_hash}_{hashlib.blake2b(srt_content.encode(), digest_size=16).hexdigest()}_{self._style_hash}"
+            cached_render = _render_cache.get(render_key)
+            if cached_render is not None:
+                logger.info(f"Subtitle render cache hit: {len(cached_render)} bytes, skipping ffmpeg")
+                return cached_render
+
+            # frag_keyframe+empty_moov makes the MP4 writable to a pipe
+            ffmpeg_cmd = [
+                '/usr/bin/ffmpeg', '-i', 'pipe:0',
+                '-vf', f"subtitles={srt_path}:force_style='{self._subtitle_style}'",
+                *self._static_output_args,
+                '-movflags', 'frag_keyframe+empty_moov+faststart',
+                '-f', 'mp4',
+                'pipe:1'
+            ]
+
+            proc = await asyncio.create_subprocess_exec(
+                *ffmpeg_cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            subtitled_video, stderr = await proc.communicate(input=video_data)
+            if proc.returncode != 0:
+                stderr_text = stderr.decode(errors='replace')
+                logger.error(f"FFmpeg subtitle addition failed: {stderr_text}")
+                raise Exception(f"FFmpeg failed: {stderr_text}")
+
+            logger.info(f"Karaoke subtitles added successfully (piped): {len(subtitled_video)} bytes")
+            _render_cache.set(render_key, subtitled_video, expire=7 * 86400)
+            return subtitled_video
+        finally:
+            try:
+                os.remove(srt_path)
+            except OSError:
+                pass
+
+    async def add_subtitles_to_video_file(self, video_path: str, srt_content: str = None) -> bytes:
+        """
+        Burn karaoke subtitles into a video already on disk
+
+        Callers that stream a download straight to a temp file use this to
+        skip the in-memory buffer and the extra temp-file copy. The caller
+        owns (and cleans up) the input file.
+        """
+        try:
             if not srt_content:
                 logger.info("No SRT provided, generating karaoke subtitles with Groq...")
                 srt_content = await self.generate_srt_from_audio(video_path, language="es")
             
             srt_path = video_path.replace('.mp4', '.srt')
-            with open(srt_path, 'w', encoding='utf-8') as srt_file:
-                srt_file.write(srt_content)
-            
+
+            def _write_srt():
+                with open(srt_path, 'w', encoding='utf-8') as srt_file:
+                    srt_file.write(srt_content)
+
+            # SRT write and video hashing are independent - overlap them
+            # off-loop instead of running each blocking step in sequence
+            _, video_hash = await asyncio.gather(
+                asyncio.to_thread(_write_srt),
+                asyncio.to_thread(_hash_file, video_path)
+            )
+
             logger.info(f"SRT written to: {srt_path}")
-            
+
             output_path = video_path.replace('.mp4', '_subtitled.mp4')
             
-            # Karaoke-style subtitles - CUSTOMIZABLE STYLE
-            subtitle_style = (
-                f"FontName={SUBTITLE_FONT},"
-                f"FontSize={SUBTITLE_FONT_SIZE},"
-                f"Bold=1,"
-                f"PrimaryColour={SUBTITLE_COLOR},"
-                f"OutlineColour={SUBTITLE_OUTLINE_COLOR},"
-                f"BorderStyle=1,"
-                f"Outline={SUBTITLE_OUTLINE_WIDTH},"
-                f"Shadow=0,"
-                f"Alignment=2,"
-                f"MarginV={SUBTITLE_MARGIN_V}"
-            )
-            
+            # Identical (video, srt, style) was rendered before: reuse it
+            render_key = f"{video_hash}_{hashlib.blake2b(srt_content.encode(), digest_size=16).hexdigest()}_{self._style_hash}"
+            cached_render = _render_cache.get(render_key)
+            if cached_render is not None:
+                logger.info(f"Subtitle render cache hit: {len(cached_render)} bytes, skipping ffmpeg")
+                try:
+                    os.remove(srt_path)
+                except OSError:
+                    pass
+                return cached_render
+
             logger.info(f"Adding karaoke-style subtitles (Font: {SUBTITLE_FONT}, Size: {SUBTITLE_FONT_SIZE}, {SUBTITLE_WORDS_PER_CHUNK} words per chunk)...")
-            
+
             ffmpeg_cmd = [
                 '/usr/bin/ffmpeg', '-i', video_path,
-                '-vf', f"subtitles={srt_path}:force_style='{subtitle_style}'",
-                '-c:v', 'libx264',
-                '-preset', 'slow',
-                '-crf', '32',
-                '-maxrate', '1.5M',
-                '-bufsize', '1.5M',
-                '-c:a', 'aac',
-                '-b:a', '96k',
+                '-vf', f"subtitles={srt_path}:force_style='{self._subtitle_style}'",
+                *self._static_output_args,
                 output_path,
                 '-y'
             ]
             
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                logger.error(f"FFmpeg subtitle addition failed: {result.stderr}")
-                raise Exception(f"FFmpeg failed: {result.stderr}")
-            
+            proc = await asyncio.create_subprocess_exec(
+                *ffmpeg_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await proc.communicate()
+            stderr_text = stderr.decode(errors='replace')
+            if proc.returncode != 0:
+                logger.error(f"FFmpeg subtitle addition failed: {stderr_text}")
+                raise Exception(f"FFmpeg failed: {stderr_text}")
+
             # Log FFmpeg warnings about fonts
-            if 'fontconfig' in result.stderr.lower() or 'font' in result.stderr.lower():
-                logger.warning(f"FFmpeg font warnings: {result.stderr}")
-            
+            if 'fontconfig' in stderr_text.lower() or 'font' in stderr_text.lower():
+                logger.warning(f"FFmpeg font warnings: {stderr_text}")
+
             logger.info("FFmpeg completed successfully")
-            
-            with open(output_path, 'rb') as output_file:
-                subtitled_video = output_file.read()
-            
+
+            def _read_output():
+                # Map the file instead of read(): one copy straight out of
+                # the page cache, no intermediate kernel read buffer while
+                # ffmpeg's output pages are still hot
+                with open(output_path, 'rb') as output_file:
+                    mm = mmap.mmap(output_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        return bytes(mm)
+                    finally:
+                        mm.close()
+
+            subtitled_video = await asyncio.to_thread(_read_output)
+
             output_size_mb = len(subtitled_video) / 1024 / 1024
             logger.info(f"Subtitled video size: {len(subtitled_video)} bytes ({output_size_mb:.2f} MB)")
             
             if output_size_mb > 100:
                 logger.warning(f"Video exceeds 100MB Instagram API limit! ({output_size_mb:.2f} MB)")
-            
+
+            _render_cache.set(render_key, subtitled_video, expire=7 * 86400)
+
             try:
-                os.remove(video_path)
                 os.remove(srt_path)
                 os.remove(output_path)
                 logger.info("Temp files cleaned up")
@@ -250,8 +452,6 @@ class SubtitleService:
         except Exception as e:
             logger.error(f"Adding subtitles failed: {str(e)}")
             try:
-                if 'video_path' in locals() and os.path.exists(video_path):
-                    os.remove(video_path)
                 if 'srt_path' in locals() and os.path.exists(srt_path):
                     os.remove(srt_path)
                 if 'output_path' in locals() and os.path.exists(output_path):
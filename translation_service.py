@@ -2,20 +2,78 @@
 Translation service using DeepL with OpenAI formatting
 """
 import logging
+import asyncio
+import hashlib
 import deepl
+import diskcache
+import requests
 from openai import AsyncOpenAI
 from config import DEEPL_API_KEY, OPENAI_API_KEY
+from error_handler import retry_with_backoff
 
 logger = logging.getLogger(__name__)
 
+# Disk-backed L2 translation cache: recurring captions (boilerplate intros,
+# hashtag blocks, reposts) skip the API entirely, surviving restarts unlike
+# the processor's small in-memory LRU. Keys are hashed source text per engine.
+_cache = diskcache.Cache('/tmp/translation_cache', size_limit=100 * 1024 * 1024)
+_CACHE_TTL = 30 * 86400
+
+
+def _cache_key(engine: str, text: str) -> str:
+    return hashlib.sha256(f"{engine}|IT|ES|{text}".encode()).hexdigest()
+
 
 class TranslationService:
     """Handles text translation from Italian to Spanish with HTML formatting"""
     
     def __init__(self):
         self.deepl_translator = deepl.Translator(DEEPL_API_KEY)
+
+        # The SDK keeps one requests.Session for the Translator's lifetime;
+        # widen its connection pool and add transport-level retries so
+        # successive translate calls (run in worker threads) reuse warm TLS
+        # sockets instead of reconnecting under pool pressure
+        internal_session = getattr(getattr(self.deepl_translator, '_client', None), '_session', None)
+        if internal_session is not None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=10, pool_maxsize=10, max_retries=3
+            )
+            internal_session.mount('https://', adapter)
+
+        # AsyncOpenAI pools connections internally; one long-lived instance
+        # per service is all that's needed
         self.openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
     
+    @retry_with_backoff(max_tries=3, base_delay=1.0)
+    async def _deepl_translate(self, text: str):
+        """The raw DeepL call, retried so one transient 429/5xx doesn't
+        immediately punt the caption to the OpenAI fallback"""
+        return await asyncio.to_thread(
+            self.deepl_translator.translate_text,
+            text,
+            source_lang="IT",
+            target_lang="ES"
+        )
+
+    @retry_with_backoff(max_tries=3, base_delay=1.0)
+    async def _openai_translate(self, text: str):
+        return await self.openai_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a translator for Instagram captions. Translate the following Italian text to Spanish. Keep hashtags, mentions (@), emojis, and line breaks exactly as they are. Return ONLY the translation, nothing else."
+                },
+                {
+                    "role": "user",
+                    "content": text
+                }
+            ],
+            temperature=0.3,
+            max_tokens=2048
+        )
+
     async def translate_caption(self, text: str) -> str:
         """
         Translate Instagram caption from Italian to Spanish
@@ -27,20 +85,25 @@ class TranslationService:
             Translated and formatted caption in Spanish
         """
         try:
+            key = _cache_key("deepl", text)
+            cached = _cache.get(key)
+            if cached is not None:
+                logger.info("Translation cache hit (DeepL)")
+                return cached
+
             # Step 1: Translate with DeepL
+            # The deepl SDK is synchronous; run it in a worker thread so the
+            # DeepL RTT doesn't stall the event loop
             logger.info(f"Translating caption with DeepL: {text[:100]}...")
-            result = self.deepl_translator.translate_text(
-                text,
-                source_lang="IT",
-                target_lang="ES"
-            )
+            result = await self._deepl_translate(text)
             translated_text = result.text
             logger.info(f"DeepL translation: {translated_text[:100]}...")
             
             # Step 2: Apply formatting with OpenAI (optional, keep simple for Instagram)
             # Instagram supports basic formatting in bio/comments, not in captions
             # So we keep the translation clean
-            
+
+            _cache.set(key, translated_text, expire=_CACHE_TTL)
             return translated_text
         
         except Exception as e:
@@ -58,27 +121,20 @@ class TranslationService:
             Translated caption in Spanish
         """
         try:
+            key = _cache_key("oai", text)
+            cached = _cache.get(key)
+            if cached is not None:
+                logger.info("Translation cache hit (OpenAI)")
+                return cached
+
             logger.info(f"Using OpenAI fallback for translation: {text[:100]}...")
-            
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a translator for Instagram captions. Translate the following Italian text to Spanish. Keep hashtags, mentions (@), emojis, and line breaks exactly as they are. Return ONLY the translation, nothing else."
-                    },
-                    {
-                        "role": "user",
-                        "content": text
-                    }
-                ],
-                temperature=0.3,
-                max_tokens=2048
-            )
-            
+
+            response = await self._openai_translate(text)
+
             translated_text = response.choices[0].message.content.strip()
             logger.info(f"OpenAI translation: {translated_text[:100]}...")
-            
+
+            _cache.set(key, translated_text, expire=_CACHE_TTL)
             return translated_text
         
         except Exception as e:
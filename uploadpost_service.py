@@ -1,10 +1,42 @@
 import logging
+import asyncio
+import hashlib
+import os
+import random
 import aiohttp
-from typing import List, Tuple
+import orjson
+from pathlib import Path
+from typing import BinaryIO, List, Tuple, Union
 from config import UPLOADPOST_API_TOKEN, UPLOADPOST_PROFILE, UPLOADPOST_API_URL
+from http_client import get_session
 
 logger = logging.getLogger(__name__)
 
+# Anything aiohttp can stream into a multipart body: in-memory buffers,
+# open binary files, or paths (opened on demand so disk bytes go straight
+# to the socket chunk by chunk instead of sitting resident in memory)
+MediaSource = Union[bytes, bytearray, memoryview, BinaryIO, str, Path]
+
+
+def _media_payload(data: MediaSource):
+    """
+    Return (payload, file_to_close) for a media source
+
+    open() touches the disk, so callers run this via asyncio.to_thread;
+    the chunked reads during the actual send already happen in the
+    loop's default executor (aiohttp streams IOBase payloads that way),
+    letting disk reads overlap concurrent socket writes.
+    """
+    if isinstance(data, (str, Path)):
+        f = open(data, 'rb')
+        return f, f
+    return data, None
+
+
+def _sha256_hex(data) -> str:
+    """Hash a buffer; run via to_thread so multi-MB videos don't stall the loop"""
+    return hashlib.sha256(data).hexdigest()
+
 
 class UploadPostService:
     
@@ -15,266 +47,326 @@ class UploadPostService:
             self.api_base_url = UPLOADPOST_API_URL.rsplit('/api/upload', 1)[0]
         else:
             self.api_base_url = UPLOADPOST_API_URL.rstrip('/')
-        
-        logger.info(f"Upload-Post base URL: {self.api_base_url}")
-    
-    async def publish_photo(self, image_data: bytes, caption: str, filename: str = "photo.jpg") -> dict:
+
+        # How many reels of one carousel may upload at the same time
+        self._reel_concurrency = int(os.getenv('UPLOADPOST_REEL_CONCURRENCY', '4'))
+
+        # The token and endpoints never change; build them once instead of
+        # formatting a header dict and URL strings on every call. The auth
+        # header stays per-request (not on the session) because the session
+        # is shared with other services.
+        self._auth_headers = {'Authorization': f'Apikey {self.api_token}'}
+        self._url_upload = f"{self.api_base_url}/api/upload"
+        self._url_upload_photos = f"{self.api_base_url}/api/upload_photos"
+
+        logger.info("Upload-Post base URL: %s", self.api_base_url)
+
+    async def prewarm(self):
+        """
+        Prewarm DNS + TCP + TLS to the Upload-Post host
+
+        Called once at bot startup so the first real publish after a
+        deploy reuses an already-negotiated connection instead of paying
+        the handshake. Best effort: failures only log.
+        """
         try:
-            logger.info(f"Publishing photo to TikTok: {filename}")
-            
-            async with aiohttp.ClientSession() as session:
+            session = await get_session()
+            async with session.get(self.api_base_url,
+                                   timeout=aiohttp.ClientTimeout(total=5)) as response:
+                logger.info("Prewarmed connection to %s (status %s)",
+                            self.api_base_url, response.status)
+        except Exception as e:
+            logger.warning("Upload-Post connection prewarm failed: %s", e)
+
+    async def _post_with_retry(self, url: str, form_factory, kind: str,
+                               max_attempts: int = 3, extra_headers: dict = None) -> dict:
+        """
+        POST a multipart form, retrying transient failures
+
+        form_factory rebuilds the FormData on every attempt because aiohttp
+        consumes the payload while sending. Retries cover connection
+        errors, timeouts, 408/429, and 5xx with exponential backoff plus
+        jitter (honoring Retry-After when present); other 4xx raise
+        immediately through _handle_response.
+        """
+        session = await get_session()
+        headers = {**self._auth_headers, **extra_headers} if extra_headers else self._auth_headers
+
+        for attempt in range(1, max_attempts + 1):
+            try:
+                async with session.post(url, data=form_factory(), headers=headers) as response:
+                    if response.status in (408, 429) or response.status >= 500:
+                        if attempt == max_attempts:
+                            return await self._handle_response(response, kind)
+                        retry_after = response.headers.get('Retry-After')
+                        delay = float(retry_after) if retry_after else 2 ** attempt + random.random() * 0.25
+                        logger.warning(
+                            "Upload-Post transient error %s (attempt %d/%d), retrying in %.1fs",
+                            response.status, attempt, max_attempts, delay
+                        )
+                    else:
+                        return await self._handle_response(response, kind)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == max_attempts:
+                    raise
+                delay = 2 ** attempt + random.random() * 0.25
+                logger.warning(
+                    "Upload-Post connection error (%s) (attempt %d/%d), retrying in %.1fs",
+                    e, attempt, max_attempts, delay
+                )
+
+            await asyncio.sleep(delay)
+
+    async def _handle_response(self, response: aiohttp.ClientResponse, kind: str) -> dict:
+        """
+        Shared status/JSON/error handling for every Upload-Post call
+
+        Raises on transport errors, API-level error payloads, and failed
+        TikTok results; returns the parsed response dict otherwise.
+        """
+        response_status = response.status
+        # Read raw bytes once; the UTF-8 decode only happens on the error
+        # and non-JSON branches, never on the JSON happy path
+        body = await response.read()
+
+        logger.info("Upload-Post response status: %s", response_status)
+
+        if response_status not in [200, 201]:
+            # Log status, request id, and a short snippet; a failed
+            # multi-MB upload shouldn't be copied into the log wholesale
+            response_text = body.decode('utf-8', errors='replace')
+            snippet = response_text[:512]
+            logger.error("Upload-Post error %d req=%s body=%s",
+                         response_status, response.headers.get('X-Request-Id'), snippet)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Upload-Post full error response: %s", response_text)
+            raise Exception(f"Upload-Post API error: {response_status} - {snippet}")
+
+        try:
+            result = orjson.loads(body)
+        except orjson.JSONDecodeError as e:
+            response_text = body.decode('utf-8', errors='replace')
+            logger.warning("Non-JSON response from Upload-Post: %s", e)
+            logger.debug("Response text: %s", response_text)
+            logger.info("%s published (non-JSON response)", kind)
+            return {"status": "success", "message": "Published", "response": response_text}
+
+        # repr-ing the full (possibly multi-KB) result dict is only worth
+        # paying for when someone is actually reading debug logs
+        logger.debug("Upload-Post JSON response: %s", result)
+
+        if isinstance(result, dict):
+            if result.get('error') or result.get('status') == 'error':
+                error_msg = result.get('message', result.get('error', 'Unknown error'))
+                logger.error("Upload-Post returned error: %s", error_msg)
+                raise Exception(f"Upload-Post returned error: {error_msg}")
+
+            # Assume the happy-path schema and catch misses, instead of
+            # allocating two fallback dicts per call with chained .get({})
+            try:
+                tiktok_result = result['results']['tiktok']
+            except (KeyError, TypeError):
+                tiktok_result = None  # no per-platform breakdown in this response
+            if tiktok_result is not None and not tiktok_result.get('success'):
+                error_msg = tiktok_result.get('error', 'Unknown TikTok error')
+                logger.error("TikTok upload failed: %s", error_msg)
+                raise Exception(f"TikTok upload failed: {error_msg}")
+
+        logger.info("%s published successfully to TikTok", kind)
+        return result
+
+    async def publish_photo(self, image_data: MediaSource, caption: str, filename: str = "photo.jpg") -> dict:
+        payload, to_close = await asyncio.to_thread(_media_payload, image_data)
+        # Slice once; form_factory may run several times across retries
+        title = caption[:100]
+        try:
+            logger.info("Publishing photo to TikTok: %s", filename)
+
+            def form_factory():
+                if hasattr(payload, 'seek'):
+                    payload.seek(0)
                 form = aiohttp.FormData()
-                form.add_field('photos[]', image_data, filename=filename, content_type='image/jpeg')
-                form.add_field('title', caption[:100])
+                form.add_field('photos[]', payload, filename=filename, content_type='image/jpeg')
+                form.add_field('title', title)
                 form.add_field('description', caption)
                 form.add_field('user', self.profile)
                 form.add_field('platform[]', 'tiktok')
-                
-                headers = {
-                    'Authorization': f'Apikey {self.api_token}'
-                }
-                
-                url = f"{self.api_base_url}/api/upload_photos"
-                logger.info(f"Sending request to: {url}")
-                
-                async with session.post(url, data=form, headers=headers) as response:
-                    response_status = response.status
-                    response_text = await response.text()
-                    
-                    logger.info(f"Upload-Post response status: {response_status}")
-                    
-                    if response_status not in [200, 201]:
-                        logger.error(f"Upload-Post error response: {response_text}")
-                        raise Exception(f"Upload-Post API error: {response_status} - {response_text}")
-                    
-                    try:
-                        result = await response.json()
-                        logger.info(f"Upload-Post JSON response: {result}")
-                        
-                        if isinstance(result, dict):
-                            if result.get('error') or result.get('status') == 'error':
-                                error_msg = result.get('message', result.get('error', 'Unknown error'))
-                                logger.error(f"Upload-Post returned error: {error_msg}")
-                                raise Exception(f"Upload-Post returned error: {error_msg}")
-                            
-                            tiktok_result = result.get('results', {}).get('tiktok', {})
-                            if not tiktok_result.get('success'):
-                                error_msg = tiktok_result.get('error', 'Unknown TikTok error')
-                                logger.error(f"TikTok upload failed: {error_msg}")
-                                raise Exception(f"TikTok upload failed: {error_msg}")
-                        
-                        logger.info(f"Photo published successfully to TikTok")
-                        return result
-                        
-                    except (ValueError, aiohttp.ContentTypeError) as e:
-                        logger.warning(f"Non-JSON response from Upload-Post: {e}")
-                        logger.info(f"Response text: {response_text}")
-                        
-                        if response_status in [200, 201]:
-                            logger.info(f"Photo published (non-JSON response)")
-                            return {"status": "success", "message": "Published", "response": response_text}
-                        else:
-                            raise Exception(f"Invalid response format: {response_text}")
-        
+                return form
+
+            logger.info("Sending request to: %s", self._url_upload_photos)
+
+            return await self._post_with_retry(self._url_upload_photos, form_factory, "Photo")
+
         except Exception as e:
-            logger.error(f"Failed to publish photo: {str(e)}")
+            logger.error("Failed to publish photo: %s", e)
             raise
-    
-    async def publish_carousel(self, items_data: List[bytes], caption: str) -> dict:
+        finally:
+            if to_close:
+                to_close.close()
+
+    async def publish_carousel(self, items_data: List[MediaSource], caption: str) -> dict:
+        # Upload-Post has no per-photo part/finalize endpoints, so the
+        # carousel has to go up as one multipart POST; _post_with_retry
+        # covers the retransmit-on-failure cost. Revisit if the API ever
+        # grows chunked uploads.
+        payloads = await asyncio.gather(
+            *[asyncio.to_thread(_media_payload, item) for item in items_data]
+        )
+        title = caption[:100]
         try:
-            logger.info(f"Publishing photo carousel to TikTok: {len(items_data)} photos")
-            
-            async with aiohttp.ClientSession() as session:
-                form = aiohttp.FormData()
-                
-                for idx, image_data in enumerate(items_data):
-                    form.add_field('photos[]', image_data, filename=f'photo_{idx}.jpg', content_type='image/jpeg')
-                
-                form.add_field('title', caption[:100])
-                form.add_field('description', caption)
-                form.add_field('user', self.profile)
-                form.add_field('platform[]', 'tiktok')
-                
-                headers = {
-                    'Authorization': f'Apikey {self.api_token}'
-                }
-                
-                url = f"{self.api_base_url}/api/upload_photos"
-                logger.info(f"Sending request to: {url}")
-                
-                async with session.post(url, data=form, headers=headers) as response:
-                    response_status = response.status
-                    response_text = await response.text()
-                    
-                    logger.info(f"Upload-Post response status: {response_status}")
-                    
-                    if response_status not in [200, 201]:
-                        logger.error(f"Upload-Post error response: {response_text}")
-                        raise Exception(f"Upload-Post API error: {response_status} - {response_text}")
-                    
-                    try:
-                        result = await response.json()
-                        logger.info(f"Upload-Post JSON response: {result}")
-                        
-                        if isinstance(result, dict):
-                            if result.get('error') or result.get('status') == 'error':
-                                error_msg = result.get('message', result.get('error', 'Unknown error'))
-                                logger.error(f"Upload-Post returned error: {error_msg}")
-                                raise Exception(f"Upload-Post returned error: {error_msg}")
-                            
-                            tiktok_result = result.get('results', {}).get('tiktok', {})
-                            if not tiktok_result.get('success'):
-                                error_msg = tiktok_result.get('error', 'Unknown TikTok error')
-                                logger.error(f"TikTok upload failed: {error_msg}")
-                                raise Exception(f"TikTok upload failed: {error_msg}")
-                        
-                        logger.info(f"Photo carousel published successfully to TikTok")
-                        return result
-                        
-                    except (ValueError, aiohttp.ContentTypeError) as e:
-                        logger.warning(f"Non-JSON response from Upload-Post: {e}")
-                        logger.info(f"Response text: {response_text}")
-                        
-                        if response_status in [200, 201]:
-                            logger.info(f"Photo carousel published (non-JSON response)")
-                            return {"status": "success", "message": "Published", "response": response_text}
-                        else:
-                            raise Exception(f"Invalid response format: {response_text}")
-        
+            logger.info("Publishing photo carousel to TikTok: %d photos", len(items_data))
+
+            # MultipartWriter skips FormData's per-field payload dispatch,
+            # which adds up across the N photo parts of a big carousel
+            def form_factory():
+                mpw = aiohttp.MultipartWriter('form-data')
+                for idx, (payload, _) in enumerate(payloads):
+                    if hasattr(payload, 'seek'):
+                        payload.seek(0)
+                    part = mpw.append(payload, {'Content-Type': 'image/jpeg'})
+                    part.set_content_disposition('form-data', name='photos[]', filename=f'photo_{idx}.jpg')
+                for name, value in (('title', title), ('description', caption),
+                                    ('user', self.profile), ('platform[]', 'tiktok')):
+                    part = mpw.append(value)
+                    part.set_content_disposition('form-data', name=name)
+                return mpw
+
+            logger.info("Sending request to: %s", self._url_upload_photos)
+
+            return await self._post_with_retry(self._url_upload_photos, form_factory, "Photo carousel")
+
         except Exception as e:
-            logger.error(f"Failed to publish photo carousel: {str(e)}")
+            logger.error("Failed to publish photo carousel: %s", e)
             raise
-    
-    async def publish_video_carousel(self, videos_data: List[bytes], caption: str) -> dict:
+        finally:
+            for _, to_close in payloads:
+                if to_close:
+                    to_close.close()
+
+    async def publish_video_carousel(self, videos_data: List[MediaSource], caption: str) -> dict:
         try:
-            logger.info(f"Publishing video carousel to TikTok: {len(videos_data)} videos")
+            logger.info("Publishing video carousel to TikTok: %d videos", len(videos_data))
             
-            results = []
-            
-            for idx, video_data in enumerate(videos_data):
-                logger.info(f"Publishing video {idx+1}/{len(videos_data)} as individual video...")
-                try:
+            # Each reel is an independent POST to the same host - run them
+            # concurrently under a cap instead of strictly one after another
+            sem = asyncio.Semaphore(self._reel_concurrency)
+            total = len(videos_data)
+
+            async def _publish_one(idx: int, video_data: bytes) -> dict:
+                async with sem:
+                    logger.info("Publishing video %d/%d as individual video...", idx + 1, total)
                     result = await self.publish_reel(video_data, caption, f"video_{idx}.mp4")
-                    results.append(result)
-                    logger.info(f"Video {idx+1}/{len(videos_data)} published successfully")
-                except Exception as e:
-                    logger.error(f"Failed to publish video {idx+1}/{len(videos_data)}: {e}")
-                    results.append({"success": False, "error": str(e)})
-            
-            logger.info(f"Video carousel publishing completed: {len([r for r in results if r.get('success', True)])} successful")
+                    logger.info("Video %d/%d published successfully", idx + 1, total)
+                    return result
+
+            gathered = await asyncio.gather(
+                *[_publish_one(idx, data) for idx, data in enumerate(videos_data)],
+                return_exceptions=True
+            )
+
+            results = []
+            ok_count = 0
+            for idx, outcome in enumerate(gathered):
+                if isinstance(outcome, BaseException):
+                    logger.error("Failed to publish video %d/%d: %s", idx + 1, total, outcome)
+                    results.append({"success": False, "error": str(outcome)})
+                else:
+                    results.append(outcome)
+                    ok_count += 1
+
+            logger.info("Video carousel publishing completed: %d/%d successful", ok_count, total)
             return {"success": True, "results": results}
         
         except Exception as e:
-            logger.error(f"Failed to publish video carousel: {str(e)}")
+            logger.error("Failed to publish video carousel: %s", e)
             raise
     
     async def publish_mixed_carousel(self, items: List[Tuple[bytes, str]], caption: str) -> dict:
         try:
-            logger.info(f"Publishing mixed carousel to TikTok: {len(items)} items")
+            logger.info("Publishing mixed carousel to TikTok: %d items", len(items))
             
             photos = []
             videos = []
             
             for idx, (data, media_type) in enumerate(items):
                 if media_type == 'photo':
-                    logger.info(f"Item {idx+1}: Photo ({len(data)} bytes)")
+                    logger.info("Item %d: Photo (%d bytes)", idx + 1, len(data))
                     photos.append(data)
                 elif media_type == 'video':
-                    logger.info(f"Item {idx+1}: Video ({len(data)} bytes)")
+                    logger.info("Item %d: Video (%d bytes)", idx + 1, len(data))
                     videos.append(data)
             
-            logger.info(f"Split carousel: {len(photos)} photos, {len(videos)} videos")
-            
-            results = {}
+            logger.info("Split carousel: %d photos, %d videos", len(photos), len(videos))
             
+            # The photo and video branches hit different endpoints and share
+            # no data - overlap their network latencies
+            tasks = []
+            labels = []
+
             if photos:
-                logger.info(f"Publishing photo carousel: {len(photos)} photos")
-                try:
-                    photo_result = await self.publish_carousel(photos, caption)
-                    results['photos'] = photo_result
-                    logger.info(f"Photo carousel published successfully")
-                except Exception as e:
-                    logger.error(f"Failed to publish photo carousel: {e}")
-                    results['photos'] = {"success": False, "error": str(e)}
-            
+                logger.info("Publishing photo carousel: %d photos", len(photos))
+                tasks.append(self.publish_carousel(photos, caption))
+                labels.append('photos')
+
             if videos:
-                logger.info(f"Publishing video carousel: {len(videos)} videos as separate posts")
-                try:
-                    video_result = await self.publish_video_carousel(videos, caption)
-                    results['videos'] = video_result
-                    logger.info(f"Video carousel published successfully")
-                except Exception as e:
-                    logger.error(f"Failed to publish video carousel: {e}")
-                    results['videos'] = {"success": False, "error": str(e)}
+                logger.info("Publishing video carousel: %d videos as separate posts", len(videos))
+                tasks.append(self.publish_video_carousel(videos, caption))
+                labels.append('videos')
+
+            gathered = await asyncio.gather(*tasks, return_exceptions=True)
+
+            results = {}
+            for label, outcome in zip(labels, gathered):
+                if isinstance(outcome, BaseException):
+                    logger.error("Failed to publish %s carousel: %s", label, outcome)
+                    results[label] = {"success": False, "error": str(outcome)}
+                else:
+                    logger.info("%s carousel published successfully", label.capitalize())
+                    results[label] = outcome
             
-            logger.info(f"Mixed carousel published: photos={bool(photos)}, videos={bool(videos)}")
+            logger.info("Mixed carousel published: photos=%s, videos=%s", bool(photos), bool(videos))
             return {"success": True, "results": results}
         
         except Exception as e:
-            logger.error(f"Failed to publish mixed carousel: {str(e)}")
+            logger.error("Failed to publish mixed carousel: %s", e)
             raise
     
-    async def publish_reel(self, video_data: bytes, caption: str, filename: str = "video.mp4") -> dict:
+    async def publish_reel(self, video_data: MediaSource, caption: str, filename: str = "video.mp4") -> dict:
+        payload, to_close = await asyncio.to_thread(_media_payload, video_data)
+        title = caption[:100]
         try:
-            logger.info(f"Publishing video to TikTok: {filename}")
-            
-            async with aiohttp.ClientSession() as session:
+            logger.info("Publishing video to TikTok: %s", filename)
+
+            def form_factory():
+                if hasattr(payload, 'seek'):
+                    payload.seek(0)
                 form = aiohttp.FormData()
-                form.add_field('video', video_data, filename=filename, content_type='video/mp4')
-                form.add_field('title', caption[:100])
+                form.add_field('video', payload, filename=filename, content_type='video/mp4')
+                form.add_field('title', title)
                 form.add_field('description', caption)
                 form.add_field('user', self.profile)
                 form.add_field('platform[]', 'tiktok')
-                
-                headers = {
-                    'Authorization': f'Apikey {self.api_token}'
-                }
-                
-                url = f"{self.api_base_url}/api/upload"
-                logger.info(f"Sending request to: {url}")
-                
-                async with session.post(url, data=form, headers=headers) as response:
-                    response_status = response.status
-                    response_text = await response.text()
-                    
-                    logger.info(f"Upload-Post response status: {response_status}")
-                    
-                    if response_status not in [200, 201]:
-                        logger.error(f"Upload-Post error response: {response_text}")
-                        raise Exception(f"Upload-Post API error: {response_status} - {response_text}")
-                    
-                    try:
-                        result = await response.json()
-                        logger.info(f"Upload-Post JSON response: {result}")
-                        
-                        if isinstance(result, dict):
-                            if result.get('error') or result.get('status') == 'error':
-                                error_msg = result.get('message', result.get('error', 'Unknown error'))
-                                logger.error(f"Upload-Post returned error: {error_msg}")
-                                raise Exception(f"Upload-Post returned error: {error_msg}")
-                            
-                            tiktok_result = result.get('results', {}).get('tiktok', {})
-                            if not tiktok_result.get('success'):
-                                error_msg = tiktok_result.get('error', 'Unknown TikTok error')
-                                logger.error(f"TikTok upload failed: {error_msg}")
-                                raise Exception(f"TikTok upload failed: {error_msg}")
-                        
-                        logger.info(f"Video published successfully to TikTok")
-                        return result
-                        
-                    except (ValueError, aiohttp.ContentTypeError) as e:
-                        logger.warning(f"Non-JSON response from Upload-Post: {e}")
-                        logger.info(f"Response text: {response_text}")
-                        
-                        if response_status in [200, 201]:
-                            logger.info(f"Video published (non-JSON response)")
-                            return {"status": "success", "message": "Published", "response": response_text}
-                        else:
-                            raise Exception(f"Invalid response format: {response_text}")
-        
+                return form
+
+            # Stable content hash so retried POSTs are deduplicated server
+            # side; hashing a multi-MB video is CPU work, keep it off the
+            # event loop. Paths/streams skip this - they'd need a full read.
+            extra_headers = None
+            if isinstance(payload, (bytes, bytearray, memoryview)):
+                digest = await asyncio.to_thread(_sha256_hex, payload)
+                extra_headers = {'Idempotency-Key': digest}
+
+            logger.info("Sending request to: %s", self._url_upload)
+
+            return await self._post_with_retry(self._url_upload, form_factory, "Video",
+                                               extra_headers=extra_headers)
+
         except Exception as e:
-            logger.error(f"Failed to publish video: {str(e)}")
+            logger.error("Failed to publish video: %s", e)
             raise
+        finally:
+            if to_close:
+                to_close.close()
 
 
 def create_uploadpost_service() -> UploadPostService: